@@ -19,20 +19,13 @@
 
 
 import timeit
-from typing import Callable, Optional
+from typing import Callable
 
 from ..configuration_utils import PretrainedConfig
 from ..file_utils import is_py3nvml_available, is_torch_available
 from ..models.auto.modeling_auto import MODEL_MAPPING, MODEL_WITH_LM_HEAD_MAPPING
 from ..utils import logging
-from .benchmark_utils import (
-    Benchmark,
-    Memory,
-    MemorySummary,
-    measure_peak_memory_cpu,
-    start_memory_tracing,
-    stop_memory_tracing,
-)
+from .benchmark_utils import Benchmark, Memory, MemorySummary, measure_peak_memory_cpu
 
 
 if is_torch_available():
@@ -58,26 +51,6 @@ class PyTorchBenchmark(Benchmark):
     def framework_version(self):
         return torch.__version__
 
-    def _inference_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
-        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
-        return self._measure_speed(_inference)
-
-    def _inference_memory(
-        self, model_name: str, batch_size: int, sequence_length: int
-    ) -> [Memory, Optional[MemorySummary]]:
-        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
-        return self._measure_memory(_inference)
-
-    def _train_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
-        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
-        return self._measure_speed(_train)
-
-    def _train_memory(
-        self, model_name: str, batch_size: int, sequence_length: int
-    ) -> [Memory, Optional[MemorySummary]]:
-        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
-        return self._measure_memory(_train)
-
     def _prepare_inference_func(self, model_name: str, batch_size: int, sequence_length: int) -> Callable[[], None]:
         config = self.config_dict[model_name]
 
@@ -223,45 +196,38 @@ class PyTorchBenchmark(Benchmark):
 
     def _measure_memory(self, func: Callable[[], None]) -> [Memory, MemorySummary]:
         try:
-            if self.args.trace_memory_line_by_line:
-                trace = start_memory_tracing("transformers")
-
-            if self.args.is_tpu:
-                # tpu
-                raise NotImplementedError(
-                    "Memory Benchmarking is currently not implemented for TPU. Please disable memory benchmarking with `--no-memory` or `args.memory=False`"
-                )
-            elif self.args.is_gpu:
-                if not is_py3nvml_available():
-                    logger.warning(
-                        "py3nvml not installed, we won't log GPU memory usage. "
-                        "Install py3nvml (pip install py3nvml) to log information about GPU."
+            with self._memory_tracing_context() as tracing:
+                if self.args.is_tpu:
+                    # tpu
+                    raise NotImplementedError(
+                        "Memory Benchmarking is currently not implemented for TPU. Please disable memory benchmarking with `--no-memory` or `args.memory=False`"
                     )
-                    memory = "N/A"
+                elif self.args.is_gpu:
+                    if not is_py3nvml_available():
+                        logger.warning(
+                            "py3nvml not installed, we won't log GPU memory usage. "
+                            "Install py3nvml (pip install py3nvml) to log information about GPU."
+                        )
+                        memory = "N/A"
+                    else:
+                        logger.info(
+                            "Measuring total GPU usage on GPU device. Make sure to not have additional processes running on the same GPU."
+                        )
+                        # init nvml
+                        nvml.nvmlInit()
+                        func()
+                        handle = nvml.nvmlDeviceGetHandleByIndex(self.args.device_idx)
+                        meminfo = nvml.nvmlDeviceGetMemoryInfo(handle)
+                        max_bytes_in_use = meminfo.used
+                        memory = Memory(max_bytes_in_use)
+                        # shutdown nvml
+                        nvml.nvmlShutdown()
                 else:
-                    logger.info(
-                        "Measuring total GPU usage on GPU device. Make sure to not have additional processes running on the same GPU."
-                    )
-                    # init nvml
-                    nvml.nvmlInit()
-                    func()
-                    handle = nvml.nvmlDeviceGetHandleByIndex(self.args.device_idx)
-                    meminfo = nvml.nvmlDeviceGetMemoryInfo(handle)
-                    max_bytes_in_use = meminfo.used
-                    memory = Memory(max_bytes_in_use)
-                    # shutdown nvml
-                    nvml.nvmlShutdown()
-            else:
-                # cpu
-                memory_bytes = measure_peak_memory_cpu(func)
-                memory = Memory(memory_bytes) if isinstance(memory_bytes, int) else memory_bytes
-
-            if self.args.trace_memory_line_by_line:
-                summary = stop_memory_tracing(trace)
-            else:
-                summary = None
-
-            return memory, summary
+                    # cpu
+                    memory_bytes = measure_peak_memory_cpu(func)
+                    memory = Memory(memory_bytes) if isinstance(memory_bytes, int) else memory_bytes
+
+            return memory, tracing.summary
         except RuntimeError as e:
             self.print_fn(f"Doesn't fit on GPU. {e}")
             return "N/A", None
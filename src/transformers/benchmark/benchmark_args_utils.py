@@ -80,6 +80,18 @@ class BenchmarkArguments:
         },
     )
     trace_memory_line_by_line: bool = field(default=False, metadata={"help": "Trace memory line by line"})
+    trace_memory_granularity: str = field(
+        default="line",
+        metadata={
+            "help": "Granularity of the memory tracing enabled with `--trace_memory_line_by_line`. Either 'line' to trace each executed line or 'call' to only trace function calls and returns, which is much faster, or 'sample' to record the memory from a background thread at regular intervals (only a few samples for short functions)."
+        },
+    )
+    trace_memory_sample_rate: float = field(
+        default=1.0,
+        metadata={
+            "help": "Proportion of the events recorded when tracing memory with `--trace_memory_line_by_line`. Lower values reduce the tracing overhead, the recorded events being drawn at random."
+        },
+    )
     save_to_csv: bool = field(default=False, metadata={"help": "Save result to a CSV file"})
     log_print: bool = field(default=False, metadata={"help": "Save all print statements in a log file"})
     env_print: bool = field(default=False, metadata={"help": "Whether to print environment information"})
@@ -21,20 +21,13 @@
 import random
 import timeit
 from functools import wraps
-from typing import Callable, Optional
+from typing import Callable
 
 from ..configuration_utils import PretrainedConfig
 from ..file_utils import is_py3nvml_available, is_tf_available
 from ..models.auto.modeling_tf_auto import TF_MODEL_MAPPING, TF_MODEL_WITH_LM_HEAD_MAPPING
 from ..utils import logging
-from .benchmark_utils import (
-    Benchmark,
-    Memory,
-    MemorySummary,
-    measure_peak_memory_cpu,
-    start_memory_tracing,
-    stop_memory_tracing,
-)
+from .benchmark_utils import Benchmark, Memory, MemorySummary, measure_peak_memory_cpu
 
 
 if is_tf_available():
@@ -87,42 +80,15 @@ class TensorFlowBenchmark(Benchmark):
     def framework_version(self):
         return tf.__version__
 
-    def _inference_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
+    def _setup_device(self):
         # initialize GPU on separate process
-        strategy = self.args.strategy
-        assert strategy is not None, "A device strategy has to be initialized before using TensorFlow."
-        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
-        return self._measure_speed(_inference)
-
-    def _train_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
-        strategy = self.args.strategy
-        assert strategy is not None, "A device strategy has to be initialized before using TensorFlow."
-        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
-        return self._measure_speed(_train)
-
-    def _inference_memory(
-        self, model_name: str, batch_size: int, sequence_length: int
-    ) -> [Memory, Optional[MemorySummary]]:
-        # initialize GPU on separate process
-        if self.args.is_gpu:
+        if self.args.memory and self.args.is_gpu:
             tf.config.experimental.set_memory_growth(self.args.gpu_list[self.args.device_idx], True)
         strategy = self.args.strategy
         assert strategy is not None, "A device strategy has to be initialized before using TensorFlow."
-        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
-        return self._measure_memory(_inference)
-
-    def _train_memory(
-        self, model_name: str, batch_size: int, sequence_length: int
-    ) -> [Memory, Optional[MemorySummary]]:
-        if self.args.is_gpu:
-            tf.config.experimental.set_memory_growth(self.args.gpu_list[self.args.device_idx], True)
-        strategy = self.args.strategy
-        assert strategy is not None, "A device strategy has to be initialized before using TensorFlow."
-
-        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
-        return self._measure_memory(_train)
 
     def _prepare_inference_func(self, model_name: str, batch_size: int, sequence_length: int) -> Callable[[], None]:
+        self._setup_device()
         config = self.config_dict[model_name]
 
         if self.args.fp16:
@@ -163,6 +129,7 @@ class TensorFlowBenchmark(Benchmark):
         return _inference
 
     def _prepare_train_func(self, model_name: str, batch_size: int, sequence_length: int) -> Callable[[], None]:
+        self._setup_device()
         config = self.config_dict[model_name]
 
         assert (
@@ -243,50 +210,48 @@ class TensorFlowBenchmark(Benchmark):
                     assert (
                         self.args.eager_mode
                     ), "`args.eager_mode` is set to `False`. Make sure to run model in eager mode to measure memory consumption line by line."
-                    trace = start_memory_tracing("transformers")
-
-                if self.args.is_tpu:
-                    # tpu
-                    raise NotImplementedError(
-                        "Memory Benchmarking is currently not implemented for TPU. Please disable memory benchmarking with `args.memory=False`"
-                    )
-                elif self.args.is_gpu:
-                    # gpu
-                    if not is_py3nvml_available():
-                        logger.warning(
-                            "py3nvml not installed, we won't log GPU memory usage. "
-                            "Install py3nvml (pip install py3nvml) to log information about GPU."
-                        )
-                        memory = "N/A"
-                    else:
-                        logger.info(
-                            "Measuring total GPU usage on GPU device. Make sure to not have additional processes running on the same GPU."
-                        )
-                        # init nvml
-                        nvml.nvmlInit()
-                        func()
-                        handle = nvml.nvmlDeviceGetHandleByIndex(self.args.device_idx)
-                        meminfo = nvml.nvmlDeviceGetMemoryInfo(handle)
-                        max_bytes_in_use = meminfo.used
-                        memory = Memory(max_bytes_in_use)
-                        # shutdown nvml
-                        nvml.nvmlShutdown()
-                else:
-                    # cpu
-                    if self.args.trace_memory_line_by_line:
-                        logger.info(
-                            "When enabling line by line tracing, the max peak memory for CPU is inaccurate in TensorFlow."
+
+                with self._memory_tracing_context() as tracing:
+                    if self.args.is_tpu:
+                        # tpu
+                        raise NotImplementedError(
+                            "Memory Benchmarking is currently not implemented for TPU. Please disable memory benchmarking with `args.memory=False`"
                         )
-                        memory = None
+                    elif self.args.is_gpu:
+                        # gpu
+                        if not is_py3nvml_available():
+                            logger.warning(
+                                "py3nvml not installed, we won't log GPU memory usage. "
+                                "Install py3nvml (pip install py3nvml) to log information about GPU."
+                            )
+                            memory = "N/A"
+                        else:
+                            logger.info(
+                                "Measuring total GPU usage on GPU device. Make sure to not have additional processes running on the same GPU."
+                            )
+                            # init nvml
+                            nvml.nvmlInit()
+                            func()
+                            handle = nvml.nvmlDeviceGetHandleByIndex(self.args.device_idx)
+                            meminfo = nvml.nvmlDeviceGetMemoryInfo(handle)
+                            max_bytes_in_use = meminfo.used
+                            memory = Memory(max_bytes_in_use)
+                            # shutdown nvml
+                            nvml.nvmlShutdown()
                     else:
-                        memory_bytes = measure_peak_memory_cpu(func)
-                        memory = Memory(memory_bytes) if isinstance(memory_bytes, int) else memory_bytes
-                if self.args.trace_memory_line_by_line:
-                    summary = stop_memory_tracing(trace)
-                    if memory is None:
-                        memory = summary.total
-                else:
-                    summary = None
+                        # cpu
+                        if self.args.trace_memory_line_by_line:
+                            logger.info(
+                                "When enabling line by line tracing, the max peak memory for CPU is inaccurate in TensorFlow."
+                            )
+                            memory = None
+                        else:
+                            memory_bytes = measure_peak_memory_cpu(func)
+                            memory = Memory(memory_bytes) if isinstance(memory_bytes, int) else memory_bytes
+
+                summary = tracing.summary
+                if memory is None:
+                    memory = summary.total
 
                 return memory, summary
             except ResourceExhaustedError as e:
@@ -17,18 +17,26 @@
 Utilities for working with the local dataset cache.
 """
 
-import copy
 import csv
+import importlib.util
 import linecache
+import math
 import os
 import platform
+import random
 import sys
+import threading
+import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from multiprocessing import Pipe, Process, Queue
 from multiprocessing.connection import Connection
-from typing import Callable, Iterable, List, NamedTuple, Optional, Union
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
 
 from .. import AutoConfig, PretrainedConfig
 from .. import __version__ as version
@@ -38,7 +46,7 @@ from .benchmark_args_utils import BenchmarkArguments
 
 
 if is_torch_available():
-    from torch.cuda import empty_cache as torch_empty_cache
+    import torch
 
 if is_tf_available():
     from tensorflow.python.eager import context as tf_context
@@ -59,6 +67,16 @@ logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
 
 _is_memory_tracing_enabled = False
+# background sampling thread started by `start_memory_tracing_sampling` and the function recording a sample
+_memory_sampler: Optional[Tuple[threading.Thread, Callable]] = None
+# function setting the hook installed by `start_memory_tracing`, the hook it replaced and the installed trace function
+_memory_tracing_hook: Optional[Tuple[Callable, Optional[Callable], Callable]] = None
+_is_nvml_initialized = False
+
+# random generator drawing the gaps between two events recorded by `start_memory_tracing` when `sampling_rate` < 1
+_trace_sampling_random = random.Random()
+# event recorded after each sampled event to measure the memory increase of the sampled event only
+_SAMPLE_END_EVENT = "sample_end"
 
 BenchmarkOutput = namedtuple(
     "BenchmarkOutput",
@@ -199,7 +217,127 @@ class MemorySummary(NamedTuple):
     total: Memory
 
 
-MemoryTrace = List[UsedMemoryState]
+class _TraceBuffer:
+    """
+    Flight-recorder style buffer used by the memory tracers to store the memory trace. The trace is stored column-wise
+    in arrays so that recording an event does not allocate any Python object. The arrays start small and are grown in
+    place up to `capacity` events, after which the oldest events are overwritten. Filenames and events are interned and
+    stored as ids.
+
+    The buffer is a read-only sequence of the recorded events as `UsedMemoryState` named tuples (oldest first). The
+    text of each line is only looked up at that point, reading the lines of each traced file once.
+    """
+
+    def __init__(self, capacity: int = 2 ** 20, initial_size: int = 2 ** 12):
+        self.capacity = capacity
+        size = min(capacity, initial_size)
+        self.cpu = array("q", [0]) * size
+        self.gpu = array("q", [0]) * size
+        self.file_ids = array("I", [0]) * size
+        self.line_nos = array("I", [0]) * size
+        self.event_ids = array("B", [0]) * size
+        self.head = 0
+        # proportion of the events recorded by the tracer, see `start_memory_tracing`
+        self.sampling_rate = 1.0
+
+        self.filenames = []
+        self.modules = []
+        self.events = []
+        self.file_id_by_filename = {}
+        self._event_ids = {}
+        self._lines = {}
+
+    def intern_filename(self, filename: str, module: str) -> int:
+        file_id = self.file_id_by_filename.get(filename)
+        if file_id is None:
+            file_id = self.file_id_by_filename[filename] = len(self.filenames)
+            self.filenames.append(sys.intern(filename))
+            self.modules.append(sys.intern(module))
+        return file_id
+
+    def intern_event(self, event: str) -> int:
+        event_id = self._event_ids.get(event)
+        if event_id is None:
+            event_id = self._event_ids[event] = len(self.events)
+            self.events.append(event)
+        return event_id
+
+    def grow(self):
+        """
+        Doubles the number of allocated events (up to `capacity`). The arrays are extended in place, so references to
+        them held by the tracers stay valid.
+        """
+        size = len(self.cpu)
+        new_size = min(self.capacity, 2 * size)
+        for column in (self.cpu, self.gpu, self.file_ids, self.line_nos, self.event_ids):
+            column.extend(array(column.typecode, [0]) * (new_size - size))
+
+    def append(self, file_id: int, line_no: int, event_id: int, cpu_memory: int, gpu_memory: int):
+        idx = self.head % self.capacity
+        try:
+            self.file_ids[idx] = file_id
+        except IndexError:
+            self.grow()
+            self.file_ids[idx] = file_id
+        self.line_nos[idx] = line_no
+        self.event_ids[idx] = event_id
+        self.cpu[idx] = cpu_memory
+        self.gpu[idx] = gpu_memory
+        self.head += 1
+
+    def __len__(self) -> int:
+        return min(self.head, self.capacity)
+
+    def _frame(self, file_id: int, line_no: int, event_id: int) -> Frame:
+        filename = self.filenames[file_id]
+        # read the lines of each file only once and index them directly
+        lines = self._lines.get(file_id)
+        if lines is None:
+            lines = self._lines[file_id] = linecache.getlines(filename)
+        line = lines[line_no - 1].rstrip() if 0 < line_no <= len(lines) else ""
+        return Frame(filename, self.modules[file_id], line_no, self.events[event_id], line)
+
+    def to_arrays(self):
+        """
+        Returns the recorded CPU memory, GPU memory and frame ids as numpy arrays (oldest event first) together with
+        the list of `Frame` indexed by the frame ids.
+        """
+        indices = np.arange(self.head - len(self), self.head) % self.capacity
+        cpu_mem = np.frombuffer(self.cpu, dtype=self.cpu.typecode)[indices]
+        gpu_mem = np.frombuffer(self.gpu, dtype=self.gpu.typecode)[indices]
+        # pack (file id, line number, event id) in a single integer so that frames are deduplicated with a 1-D unique
+        file_ids = np.frombuffer(self.file_ids, dtype=self.file_ids.typecode)[indices].astype(np.uint64)
+        line_nos = np.frombuffer(self.line_nos, dtype=self.line_nos.typecode)[indices].astype(np.uint64)
+        event_ids = np.frombuffer(self.event_ids, dtype=self.event_ids.typecode)[indices].astype(np.uint64)
+        frame_keys = (file_ids << np.uint64(40)) | (line_nos << np.uint64(8)) | event_ids
+        unique_keys, frame_ids = np.unique(frame_keys, return_inverse=True)
+        frames = [self._frame(key >> 40, (key >> 8) & 0xFFFFFFFF, key & 0xFF) for key in unique_keys.tolist()]
+        return cpu_mem, gpu_mem, frame_ids, frames
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("memory trace index out of range")
+        idx = (self.head - len(self) + index) % self.capacity
+        frame = self._frame(self.file_ids[idx], self.line_nos[idx], self.event_ids[idx])
+        return UsedMemoryState(frame, self.cpu[idx], self.gpu[idx])
+
+    def __iter__(self):
+        frames = {}
+        start = self.head - len(self)
+        for i in range(start, self.head):
+            idx = i % self.capacity
+            key = (self.file_ids[idx], self.line_nos[idx], self.event_ids[idx])
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = self._frame(*key)
+            yield UsedMemoryState(frame, self.cpu[idx], self.gpu[idx])
+
+
+MemoryTrace = Union[List[UsedMemoryState], _TraceBuffer]
 
 
 def measure_peak_memory_cpu(function: Callable[[], None], interval=0.5, device_idx=None) -> int:
@@ -323,32 +461,197 @@ def measure_peak_memory_cpu(function: Callable[[], None], interval=0.5, device_i
         return max_memory
 
 
+def _setup_memory_tracing(gpus_to_trace: Optional[List[int]] = None):
+    """
+    Returns the psutil process (or None) and a function returning the GPU memory used by the GPU devices to trace (or
+    None if GPU memory is not logged).
+
+    If PyTorch has initialized CUDA, the GPU memory is the memory allocated by the PyTorch caching allocator, which is
+    only a bookkeeping read. Otherwise it is the used memory reported by NVML, which stays initialized until
+    `_shutdown_nvml` is called by `stop_memory_tracing`.
+    """
+    global _is_nvml_initialized
+
+    if is_psutil_available():
+        process = psutil.Process(os.getpid())
+    else:
+        logger.warning(
+            "Psutil not installed, we won't log CPU memory usage. "
+            "Install psutil (pip install psutil) to use CPU memory tracing."
+        )
+        process = None
+
+    read_gpu_memory = None
+    if is_torch_available() and torch.cuda.is_initialized():
+        devices = list(range(torch.cuda.device_count())) if gpus_to_trace is None else gpus_to_trace
+
+        def read_torch_gpu_memory():
+            return sum(torch.cuda.memory_allocated(i) for i in devices)
+
+        read_gpu_memory = read_torch_gpu_memory
+
+    elif is_py3nvml_available():
+        try:
+            nvml.nvmlInit()
+            _is_nvml_initialized = True
+            devices = list(range(nvml.nvmlDeviceGetCount())) if gpus_to_trace is None else gpus_to_trace
+            handles = [nvml.nvmlDeviceGetHandleByIndex(i) for i in devices]
+        except (OSError, nvml.NVMLError):
+            logger.warning("Error while initializing communication with GPU. " "We won't perform GPU memory tracing.")
+            _shutdown_nvml()
+        else:
+            if is_torch_available() or is_tf_available():
+
+                def read_nvml_gpu_memory():
+                    return sum(nvml.nvmlDeviceGetMemoryInfo(handle).used for handle in handles)
+
+                read_gpu_memory = read_nvml_gpu_memory
+
+                if is_tf_available():
+                    # Clear GPU caches once so that the traced memory is not polluted by previously cached memory
+                    tf_context.context()._clear_caches()  # See https://github.com/tensorflow/tensorflow/issues/20218#issuecomment-416771802
+            else:
+                _shutdown_nvml()
+    else:
+        logger.warning(
+            "py3nvml not installed, we won't log GPU memory usage. "
+            "Install py3nvml (pip install py3nvml) to use GPU memory tracing."
+        )
+
+    return process, read_gpu_memory
+
+
+def _shutdown_nvml():
+    """
+    Shuts down NVML if it was initialized by `_setup_memory_tracing`
+    """
+    global _is_nvml_initialized
+
+    if _is_nvml_initialized:
+        _is_nvml_initialized = False
+        try:
+            nvml.nvmlShutdown()
+        except nvml.NVMLError:
+            logger.warning("Error while shutting down communication with GPU.")
+
+
+def _modules_to_tuple(modules: Optional[Union[str, Iterable[str]]]) -> Tuple[str, ...]:
+    """
+    Normalizes a `modules_to_trace` / `modules_not_to_trace` argument into a (possibly empty) tuple of module names
+    """
+    if modules is None:
+        return ()
+    if isinstance(modules, str):
+        return (modules,)
+    return tuple(modules)
+
+
+def _modules_to_path_prefixes(modules: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+    """
+    Resolves module names to the paths of their source files (modules) or directories (packages) so that frames can be
+    filtered on `frame.f_code.co_filename`. Returns None if one of the modules cannot be resolved.
+    """
+    prefixes = []
+    for module in modules:
+        try:
+            spec = importlib.util.find_spec(module)
+        except (ImportError, AttributeError, ValueError):
+            return None
+        if spec is None:
+            return None
+        if spec.submodule_search_locations:
+            prefixes.extend(os.path.join(location, "") for location in spec.submodule_search_locations)
+        elif spec.has_location and spec.origin:
+            prefixes.append(spec.origin)
+        else:
+            return None
+    return tuple(prefixes)
+
+
+def _module_filter(
+    modules_to_trace: Optional[Union[str, Iterable[str]]], modules_not_to_trace: Optional[Union[str, Iterable[str]]]
+) -> Tuple[Tuple[str, ...], Callable[[object], bool]]:
+    """
+    Builds the filters used by the memory tracers from `modules_to_trace` and `modules_not_to_trace`.
+
+    Returns a tuple of path prefixes that the filename of a traced frame has to start with (empty if all files can be
+    traced) and a function telling if a module name should be traced. The module name of a file never changes, so the
+    tracers only call the latter the first time they see a file.
+    """
+    whitelist = _modules_to_tuple(modules_to_trace)
+    blacklist = _modules_to_tuple(modules_not_to_trace)
+
+    allowed_prefixes = _modules_to_path_prefixes(whitelist) if whitelist else ()
+    if allowed_prefixes is None:
+        # fall back to matching the module names
+        allowed_prefixes = ()
+    else:
+        whitelist = ()
+
+    def is_traced_module(name) -> bool:
+        if not isinstance(name, str):
+            return False
+        if whitelist and not name.startswith(whitelist):
+            return False
+        if blacklist and any(m in name for m in blacklist):
+            return False
+        return True
+
+    return allowed_prefixes, is_traced_module
+
+
 def start_memory_tracing(
     modules_to_trace: Optional[Union[str, Iterable[str]]] = None,
     modules_not_to_trace: Optional[Union[str, Iterable[str]]] = None,
     events_to_trace: str = "line",
     gpus_to_trace: Optional[List[int]] = None,
-) -> MemoryTrace:
+    max_trace_length: int = 2 ** 20,
+    cpu_poll_interval_us: int = 0,
+    gpu_poll_interval_us: int = 100,
+    granularity: str = "line",
+    sampling_rate: float = 1.0,
+) -> _TraceBuffer:
     """
     Setup line-by-line tracing to record rss mem (RAM) at each line of a module or sub-module. See `./benchmark.py` for
-    usage examples. Current memory consumption is returned using psutil and in particular is the RSS memory "Resident
-    Set Size” (the non-swapped physical memory the process is using). See
+    usage examples. With `granularity="call"`, memory is only recorded when a function is called or returns, which is
+    much cheaper than tracing every line. Current memory consumption is returned using psutil and in particular is the
+    RSS memory "Resident Set Size” (the non-swapped physical memory the process is using). See
     https://psutil.readthedocs.io/en/latest/#psutil.Process.memory_info
 
+    If PyTorch has initialized CUDA, the GPU memory is the memory allocated by tensors as tracked by the PyTorch
+    caching allocator (`torch.cuda.memory_allocated`), which does not require a device synchronization. Otherwise it is
+    the used memory reported by NVML for the whole device (e.g. for TensorFlow).
+
     Args:
 
         - `modules_to_trace`: (None, string, list/tuple of string) if None, all events are recorded if string or list
-          of strings: only events from the listed module/sub-module will be recorded (e.g. 'fairseq' or
-          'transformers.models.gpt2.modeling_gpt2')
+          of strings: only events from the listed module/sub-module will be recorded, i.e. from modules whose name
+          starts with one of the given names (e.g. 'fairseq' or 'transformers.models.gpt2.modeling_gpt2')
         - `modules_not_to_trace`: (None, string, list/tuple of string) if None, no module is avoided if string or list
           of strings: events from the listed module/sub-module will not be recorded (e.g. 'torch')
         - `events_to_trace`: string or list of string of events to be recorded (see official python doc for
           `sys.settrace` for the list of events) default to line
         - `gpus_to_trace`: (optional list, default None) list of GPUs to trace. Default to tracing all GPUs
+        - `max_trace_length`: (int, default 2 ** 20) maximum number of recorded events. Once reached, the oldest events
+          are overwritten
+        - `cpu_poll_interval_us`: (int, default 0) minimum time in micro-seconds between two reads of the rss memory.
+          Events recorded in between reuse the last read value, so their memory increase is attributed to the next
+          polled event. By default the memory is read at each event
+        - `gpu_poll_interval_us`: (int, default 100) minimum time in micro-seconds between two reads of the GPU memory.
+          Events recorded in between reuse the last read value. Set to 0 to read the memory at each event
+        - `granularity`: (string, default "line") either "line" to trace with `sys.settrace` or "call" to trace only
+          "call" and "return" events with `sys.setprofile`. In the latter case `events_to_trace` is ignored
+        - `sampling_rate`: (float, default 1.0) proportion of the events to record. Recorded events are drawn at random
+          (the number of events between two recorded events follows a geometric distribution). The memory is also
+          recorded at the event following each sampled event (with the event "sample_end") so that only the memory
+          increase of the sampled event is attributed to it, the memory is then read at each recorded event regardless
+          of the poll intervals. The cumulative and total memory increases of the summary are scaled by 1 /
+          `sampling_rate`
 
     Return:
 
-        - `memory_trace` is a list of `UsedMemoryState` for each event (default each line of the traced script).
+        - `memory_trace` is a sequence of `UsedMemoryState`, one for each recorded event (default each line of the
+          traced script), oldest first.
 
             - `UsedMemoryState` are named tuples with the following fields:
 
@@ -356,7 +659,7 @@ def start_memory_tracing(
                   file, location in current file)
                 - 'cpu_memory': CPU RSS memory state *before* executing the line
                 - 'gpu_memory': GPU used memory *before* executing the line (sum for all GPUs or for only
-                  `gpus_to_trace` if provided)
+                  `gpus_to_trace` if provided), see above for how it is measured
 
     `Frame` is a namedtuple used by `UsedMemoryState` to list the current frame state. `Frame` has the following
     fields: - 'filename' (string): Name of the file currently executed - 'module' (string): Name of the module
@@ -364,114 +667,257 @@ def start_memory_tracing(
     triggered the tracing (default will be "line") - 'line_text' (string): Text of the line in the python script
 
     """
-    if is_psutil_available():
-        process = psutil.Process(os.getpid())
+    if granularity not in ("line", "call"):
+        raise ValueError(f"`granularity` should be one of 'line' or 'call', but is {granularity}")
+    if not 0 < sampling_rate <= 1:
+        raise ValueError(f"`sampling_rate` should be in (0, 1], but is {sampling_rate}")
+
+    process, read_gpu_memory = _setup_memory_tracing(gpus_to_trace)
+
+    # Normalize the filters once so that the trace function only does set / tuple lookups
+    if granularity == "call":
+        # the profile function is also called for C functions, only keep python calls
+        events_set = frozenset(["call", "return"])
+    elif isinstance(events_to_trace, str):
+        events_set = frozenset([events_to_trace])
     else:
-        logger.warning(
-            "Psutil not installed, we won't log CPU memory usage. "
-            "Install psutil (pip install psutil) to use CPU memory tracing."
-        )
-        process = None
-
-    if is_py3nvml_available():
-        try:
-            nvml.nvmlInit()
-            devices = list(range(nvml.nvmlDeviceGetCount())) if gpus_to_trace is None else gpus_to_trace
-            nvml.nvmlShutdown()
-        except (OSError, nvml.NVMLError):
-            logger.warning("Error while initializing communication with GPU. " "We won't perform GPU memory tracing.")
-            log_gpu = False
-        else:
-            log_gpu = is_torch_available() or is_tf_available()
+        events_set = frozenset(events_to_trace or [])
+    allowed_prefixes, is_traced_module = _module_filter(modules_to_trace, modules_not_to_trace)
+    # the tracing code of this module (e.g. stopping the tracing) is never recorded
+    skipped_files = {__file__}
+
+    memory_trace = _TraceBuffer(max_trace_length)
+    memory_trace.sampling_rate = sampling_rate
+
+    cpu_mem = gpu_mem = 0
+    last_cpu_poll = last_gpu_poll = float("-inf")
+    if sampling_rate < 1:
+        # the memory increase of a sampled event is the difference between two consecutive recorded events
+        cpu_poll_interval = gpu_poll_interval = 0
     else:
-        logger.warning(
-            "py3nvml not installed, we won't log GPU memory usage. "
-            "Install py3nvml (pip install py3nvml) to use GPU memory tracing."
-        )
-        log_gpu = False
-
-    memory_trace = []
+        cpu_poll_interval = cpu_poll_interval_us / 1e6
+        gpu_poll_interval = gpu_poll_interval_us / 1e6
+
+    # bind everything used for each event to closure variables to avoid global and attribute lookups in `traceit`
+    file_id_by_filename = memory_trace.file_id_by_filename
+    event_ids = {event: memory_trace.intern_event(event) for event in events_set}
+    capacity = memory_trace.capacity
+    cpu_column, gpu_column = memory_trace.cpu, memory_trace.gpu
+    file_id_column, line_no_column, event_id_column = (
+        memory_trace.file_ids,
+        memory_trace.line_nos,
+        memory_trace.event_ids,
+    )
+    perf_counter = time.perf_counter
+    read_cpu_memory = process.memory_info if process is not None else None
+
+    # number of events until the next sampled one and whether the next event ends the measure of a sampled event
+    next_sample = 1
+    sample_pending = False
+    if sampling_rate < 1:
+        log_skip_probability = math.log(1 - sampling_rate)
+        random_uniform = _trace_sampling_random.random
+        sample_end_event_id = memory_trace.intern_event(_SAMPLE_END_EVENT)
 
     def traceit(frame, event, args):
         """
         Tracing method executed before running each line in a module or sub-module Record memory allocated in a list
         with debugging information
         """
-        global _is_memory_tracing_enabled
-
-        if not _is_memory_tracing_enabled:
+        # Filter events
+        if events_set and event not in events_set:
             return traceit
 
-        # Filter events
-        if events_to_trace is not None:
-            if isinstance(events_to_trace, str) and event != events_to_trace:
+        # Filter modules, the module name is only checked the first time a file is seen
+        filename = frame.f_code.co_filename
+        if allowed_prefixes and not filename.startswith(allowed_prefixes):
+            return traceit
+        file_id = file_id_by_filename.get(filename)
+        if file_id is None:
+            if filename in skipped_files:
                 return traceit
-            elif isinstance(events_to_trace, (list, tuple)) and event not in events_to_trace:
+            name = frame.f_globals.get("__name__")
+            if not is_traced_module(name):
+                skipped_files.add(filename)
                 return traceit
+            file_id = memory_trace.intern_filename(filename, name)
+
+        # Only record a random subset of the events when sampling, and the event following each of them
+        nonlocal next_sample, sample_pending
+        event_id = None
+        if sampling_rate < 1:
+            next_sample -= 1
+            if next_sample > 0:
+                if not sample_pending:
+                    return traceit
+                sample_pending = False
+                event_id = sample_end_event_id
+            else:
+                next_sample = 1 + int(math.log(1 - random_uniform()) / log_skip_probability)
+                sample_pending = True
 
-        if "__name__" not in frame.f_globals:
-            return traceit
+        # Record current tracing state (file, location in file...)
+        if event_id is None:
+            event_id = event_ids.get(event)
+            if event_id is None:
+                event_id = event_ids[event] = memory_trace.intern_event(event)
+
+        # Record current memory state (rss memory), memory is only polled again once the poll interval has elapsed
+        nonlocal cpu_mem, gpu_mem, last_cpu_poll, last_gpu_poll
+        now = perf_counter()
+        if read_cpu_memory is not None and now - last_cpu_poll >= cpu_poll_interval:
+            cpu_mem = read_cpu_memory().rss
+            last_cpu_poll = now
+
+        if read_gpu_memory is not None and now - last_gpu_poll >= gpu_poll_interval:
+            # Sum used memory for all GPUs
+            gpu_mem = read_gpu_memory()
+            last_gpu_poll = now
 
-        # Filter modules
-        name = frame.f_globals["__name__"]
-        if not isinstance(name, str):
-            return traceit
-        else:
-            # Filter whitelist of modules to trace
-            if modules_to_trace is not None:
-                if isinstance(modules_to_trace, str) and modules_to_trace not in name:
-                    return traceit
-                elif isinstance(modules_to_trace, (list, tuple)) and all(m not in name for m in modules_to_trace):
-                    return traceit
+        # same as `memory_trace.append(...)` without the method call
+        idx = memory_trace.head % capacity
+        try:
+            file_id_column[idx] = file_id
+        except IndexError:
+            memory_trace.grow()
+            file_id_column[idx] = file_id
+        line_no_column[idx] = frame.f_lineno
+        event_id_column[idx] = event_id
+        cpu_column[idx] = cpu_mem
+        gpu_column[idx] = gpu_mem
+        memory_trace.head += 1
 
-            # Filter blacklist of modules not to trace
-            if modules_not_to_trace is not None:
-                if isinstance(modules_not_to_trace, str) and modules_not_to_trace in name:
-                    return traceit
-                elif isinstance(modules_not_to_trace, (list, tuple)) and any(m in name for m in modules_not_to_trace):
-                    return traceit
+        return traceit
 
-        # Record current tracing state (file, location in file...)
-        lineno = frame.f_lineno
-        filename = frame.f_globals["__file__"]
-        if filename.endswith(".pyc") or filename.endswith(".pyo"):
-            filename = filename[:-1]
-        line = linecache.getline(filename, lineno).rstrip()
-        traced_state = Frame(filename, name, lineno, event, line)
-
-        # Record current memory state (rss memory) and compute difference with previous memory state
-        cpu_mem = 0
-        if process is not None:
-            mem = process.memory_info()
-            cpu_mem = mem.rss
-
-        gpu_mem = 0
-        if log_gpu:
-            # Clear GPU caches
-            if is_torch_available():
-                torch_empty_cache()
-            if is_tf_available():
-                tf_context.context()._clear_caches()  # See https://github.com/tensorflow/tensorflow/issues/20218#issuecomment-416771802
+    # keep the hook we replace (e.g. a debugger or coverage tool) to restore it when tracing is stopped
+    global _is_memory_tracing_enabled, _memory_tracing_hook
+    if granularity == "call":
+        _memory_tracing_hook = (sys.setprofile, sys.getprofile(), traceit)
+        sys.setprofile(traceit)
+    else:
+        _memory_tracing_hook = (sys.settrace, sys.gettrace(), traceit)
+        sys.settrace(traceit)
 
-            # Sum used memory for all GPUs
-            nvml.nvmlInit()
+    _is_memory_tracing_enabled = True
 
-            for i in devices:
-                handle = nvml.nvmlDeviceGetHandleByIndex(i)
-                meminfo = nvml.nvmlDeviceGetMemoryInfo(handle)
-                gpu_mem += meminfo.used
+    return memory_trace
 
-            nvml.nvmlShutdown()
 
-        mem_state = UsedMemoryState(traced_state, cpu_mem, gpu_mem)
-        memory_trace.append(mem_state)
+def start_memory_tracing_sampling(
+    modules_to_trace: Optional[Union[str, Iterable[str]]] = None,
+    modules_not_to_trace: Optional[Union[str, Iterable[str]]] = None,
+    gpus_to_trace: Optional[List[int]] = None,
+    interval_us: int = 100,
+    max_trace_length: int = 2 ** 20,
+) -> _TraceBuffer:
+    """
+    Setup statistical memory tracing: instead of calling a trace function on every executed line (see
+    `start_memory_tracing`), a background thread wakes up every `interval_us` micro-seconds, records the rss memory
+    (RAM) and GPU memory and attributes it to the line currently executed by the thread that started the tracing. The
+    overhead on the traced program is therefore independent of the number of executed lines.
 
-        return traceit
+    Args:
 
-    sys.settrace(traceit)
+        - `modules_to_trace`: (None, string, list/tuple of string) if None, all samples are recorded if string or list
+          of strings: only samples from the listed module/sub-module will be recorded, i.e. from modules whose name
+          starts with one of the given names (e.g. 'fairseq' or 'transformers.models.gpt2.modeling_gpt2'). If the
+          current line is not in one of the listed modules, the sample is attributed to the innermost calling frame
+          that is.
+        - `modules_not_to_trace`: (None, string, list/tuple of string) if None, no module is avoided if string or list
+          of strings: samples from the listed module/sub-module will not be recorded (e.g. 'torch')
+        - `gpus_to_trace`: (optional list, default None) list of GPUs to trace. Default to tracing all GPUs
+        - `interval_us`: (int, default 100) sampling interval in micro-seconds. The effective sampling rate is bounded
+          by the interpreter switch interval (see `sys.setswitchinterval`). A sample is also recorded when tracing is
+          started and when it is stopped, so that the trace always covers the traced code even if it runs for less than
+          a switch interval
+        - `max_trace_length`: (int, default 2 ** 20) maximum number of recorded samples. Once reached, the oldest
+          samples are overwritten
+
+    Return:
+
+        - `memory_trace` is a sequence of `UsedMemoryState`, one for each sample, with the same format as the one
+          returned by `start_memory_tracing` so that it can be summarized with `stop_memory_tracing`. The `event` field
+          of each `Frame` is set to "sample".
+    """
+    global _is_memory_tracing_enabled, _memory_sampler
+
+    process, read_gpu_memory = _setup_memory_tracing(gpus_to_trace)
+
+    allowed_prefixes, is_traced_module = _module_filter(modules_to_trace, modules_not_to_trace)
+    # samples are never attributed to the tracing code of this module
+    skipped_files = {__file__}
+    # files passing the filters, the trace may also contain the files of samples recorded when starting / stopping
+    traced_file_ids = {}
+
+    memory_trace = _TraceBuffer(max_trace_length)
+    sample_event_id = memory_trace.intern_event("sample")
+    traced_thread_id = threading.get_ident()
+    interval = interval_us / 1e6
+
+    def traced_file_id(frame) -> Optional[int]:
+        filename = frame.f_code.co_filename
+        if allowed_prefixes and not filename.startswith(allowed_prefixes):
+            return None
+        file_id = traced_file_ids.get(filename)
+        if file_id is None and filename not in skipped_files:
+            name = frame.f_globals.get("__name__")
+            if is_traced_module(name):
+                file_id = traced_file_ids[filename] = memory_trace.intern_filename(filename, name)
+            else:
+                skipped_files.add(filename)
+        return file_id
+
+    def record_sample(frame, force: bool = False):
+        """
+        Records the current memory and attributes it to the innermost traced frame of the stack starting at `frame`. If
+        no frame is traced, the sample is only recorded if `force` is set, and attributed to the innermost frame
+        calling the tracing functions.
+        """
+        traced_frame = frame
+        file_id = None
+        while traced_frame is not None:
+            file_id = traced_file_id(traced_frame)
+            if file_id is not None:
+                break
+            traced_frame = traced_frame.f_back
+
+        if traced_frame is None:
+            if not force:
+                return
+            traced_frame = frame
+            while traced_frame.f_back is not None and traced_frame.f_code.co_filename == __file__:
+                traced_frame = traced_frame.f_back
+            file_id = memory_trace.intern_filename(
+                traced_frame.f_code.co_filename, str(traced_frame.f_globals.get("__name__"))
+            )
+
+        cpu_mem = process.memory_info().rss if process is not None else 0
+        gpu_mem = read_gpu_memory() if read_gpu_memory is not None else 0
+
+        memory_trace.append(file_id, traced_frame.f_lineno, sample_event_id, cpu_mem, gpu_mem)
+
+    def sample():
+        """
+        Sampling loop executed in a background thread until `stop_memory_tracing` is called
+        """
+        next_sample_time = time.perf_counter()
+        while _is_memory_tracing_enabled:
+            record_sample(sys._current_frames().get(traced_thread_id))
+
+            next_sample_time += interval
+            delay = next_sample_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample_time = time.perf_counter()
+
+    # record a first sample from the traced thread, the background thread may not run before tracing is stopped
+    record_sample(sys._getframe(1), force=True)
 
-    global _is_memory_tracing_enabled
     _is_memory_tracing_enabled = True
+    sampling_thread = threading.Thread(target=sample, daemon=True)
+    _memory_sampler = (sampling_thread, record_sample)
+    sampling_thread.start()
 
     return memory_trace
 
@@ -480,7 +926,8 @@ def stop_memory_tracing(
     memory_trace: Optional[MemoryTrace] = None, ignore_released_memory: bool = True
 ) -> Optional[MemorySummary]:
     """
-    Stop memory tracing cleanly and return a summary of the memory trace if a trace is given.
+    Stop memory tracing cleanly and return a summary of the memory trace if a trace is given. Has to be called from the
+    thread which started the tracing.
 
     Args:
 
@@ -516,6 +963,9 @@ def stop_memory_tracing(
         - 'event' (string): Event that triggered the tracing (default will be "line")
         - 'line_text' (string): Text of the line in the python script
 
+    When the trace was recorded with a `sampling_rate` lower than 1, only the memory increase of the sampled events is
+    part of the summary and the cumulative and total memory increases are scaled by 1 / `sampling_rate`.
+
     `MemoryState` are namedtuples listing frame + CPU/GPU memory with the following fields:
 
         - `frame` (`Frame`): the current frame (see above)
@@ -523,63 +973,124 @@ def stop_memory_tracing(
         - `gpu`: GPU memory consumed at during the current frame as a `Memory` named tuple
         - `cpu_gpu`: CPU + GPU memory consumed at during the current frame as a `Memory` named tuple
     """
-    global _is_memory_tracing_enabled
+    global _is_memory_tracing_enabled, _memory_sampler, _memory_tracing_hook
     _is_memory_tracing_enabled = False
 
+    # uninstall the tracer so that it doesn't cost anything once tracing is stopped, and restore the previous hook
+    if _memory_tracing_hook is not None:
+        set_hook, previous_hook, trace_function = _memory_tracing_hook
+        _memory_tracing_hook = None
+        set_hook(previous_hook)
+        # frames entered while tracing line by line keep the trace function as local trace function
+        frame = sys._getframe()
+        while frame is not None:
+            if frame.f_trace is trace_function:
+                frame.f_trace = None
+            frame = frame.f_back
+
+    if _memory_sampler is not None:
+        sampling_thread, record_sample = _memory_sampler
+        _memory_sampler = None
+        sampling_thread.join()
+        # record a last sample from the traced thread so that the trace covers all the traced code
+        record_sample(sys._getframe(1), force=True)
+
+    _shutdown_nvml()
+
     if memory_trace is not None and len(memory_trace) > 1:
-        memory_diff_trace = []
-        memory_curr_trace = []
-
-        cumulative_memory_dict = defaultdict(lambda: [0, 0, 0])
-
-        for (
-            (frame, cpu_mem, gpu_mem),
-            (next_frame, next_cpu_mem, next_gpu_mem),
-        ) in zip(memory_trace[:-1], memory_trace[1:]):
-            cpu_mem_inc = next_cpu_mem - cpu_mem
-            gpu_mem_inc = next_gpu_mem - gpu_mem
-            cpu_gpu_mem_inc = cpu_mem_inc + gpu_mem_inc
-            memory_diff_trace.append(
-                MemoryState(
-                    frame=frame,
-                    cpu=Memory(cpu_mem_inc),
-                    gpu=Memory(gpu_mem_inc),
-                    cpu_gpu=Memory(cpu_gpu_mem_inc),
+        sampling_rate = 1.0
+        if isinstance(memory_trace, _TraceBuffer):
+            sampling_rate = memory_trace.sampling_rate
+            if memory_trace.head > memory_trace.capacity:
+                logger.warning(
+                    f"The memory trace exceeded its maximum length of {memory_trace.capacity} events, the oldest "
+                    f"{memory_trace.head - memory_trace.capacity} events were dropped and are not part of the summary. "
+                    "Increase `max_trace_length` to keep them."
                 )
+            cpu_mem, gpu_mem, frame_ids, frames = memory_trace.to_arrays()
+        else:
+            frame_index = {}
+            frame_ids = np.array([frame_index.setdefault(state.frame, len(frame_index)) for state in memory_trace])
+            frames = list(frame_index)
+            cpu_mem = np.array([state.cpu_memory for state in memory_trace], dtype=np.int64)
+            gpu_mem = np.array([state.gpu_memory for state in memory_trace], dtype=np.int64)
+
+        # memory increase of each event is the memory before the next event minus the memory before the event
+        frame_ids = frame_ids[:-1]
+        cpu_mem_inc = np.diff(cpu_mem)
+        gpu_mem_inc = np.diff(gpu_mem)
+        cpu_gpu_mem_inc = cpu_mem_inc + gpu_mem_inc
+        next_cpu_mem = cpu_mem[1:]
+        next_gpu_mem = gpu_mem[1:]
+
+        if sampling_rate < 1:
+            # the memory increase from a "sample_end" event to the next sampled event covers the skipped events
+            is_measured = np.array([frame.event != _SAMPLE_END_EVENT for frame in frames], dtype=bool)[frame_ids]
+            frame_ids = frame_ids[is_measured]
+            cpu_mem_inc = cpu_mem_inc[is_measured]
+            gpu_mem_inc = gpu_mem_inc[is_measured]
+            cpu_gpu_mem_inc = cpu_gpu_mem_inc[is_measured]
+            next_cpu_mem = next_cpu_mem[is_measured]
+            next_gpu_mem = next_gpu_mem[is_measured]
+
+        memory_diff_trace = [
+            MemoryState(
+                frame=frames[frame_id],
+                cpu=Memory(cpu_inc),
+                gpu=Memory(gpu_inc),
+                cpu_gpu=Memory(cpu_gpu_inc),
             )
-
-            memory_curr_trace.append(
-                MemoryState(
-                    frame=frame,
-                    cpu=Memory(next_cpu_mem),
-                    gpu=Memory(next_gpu_mem),
-                    cpu_gpu=Memory(next_gpu_mem + next_cpu_mem),
-                )
+            for frame_id, cpu_inc, gpu_inc, cpu_gpu_inc in zip(
+                frame_ids.tolist(), cpu_mem_inc.tolist(), gpu_mem_inc.tolist(), cpu_gpu_mem_inc.tolist()
             )
+        ]
 
-            cumulative_memory_dict[frame][0] += cpu_mem_inc
-            cumulative_memory_dict[frame][1] += gpu_mem_inc
-            cumulative_memory_dict[frame][2] += cpu_gpu_mem_inc
-
-        cumulative_memory = sorted(
-            list(cumulative_memory_dict.items()), key=lambda x: x[1][2], reverse=True
-        )  # order by the total CPU + GPU memory increase
-        cumulative_memory = list(
+        # order by the current CPU + GPU memory, a stable sort keeps the trace order for equal memory
+        curr_order = np.argsort(-(next_cpu_mem + next_gpu_mem), kind="stable")
+        memory_curr_trace = [
             MemoryState(
-                frame=frame,
-                cpu=Memory(cpu_mem_inc),
-                gpu=Memory(gpu_mem_inc),
-                cpu_gpu=Memory(cpu_gpu_mem_inc),
+                frame=frames[frame_id],
+                cpu=Memory(cpu),
+                gpu=Memory(gpu),
+                cpu_gpu=Memory(cpu + gpu),
             )
-            for frame, (cpu_mem_inc, gpu_mem_inc, cpu_gpu_mem_inc) in cumulative_memory
-        )
-
-        memory_curr_trace = sorted(memory_curr_trace, key=lambda x: x.cpu_gpu.bytes, reverse=True)
+            for frame_id, cpu, gpu in zip(
+                frame_ids[curr_order].tolist(), next_cpu_mem[curr_order].tolist(), next_gpu_mem[curr_order].tolist()
+            )
+        ]
+
+        # sum the memory increase of each frame, frames are kept in order of first appearance
+        unique_frame_ids, first_index, inverse = np.unique(frame_ids, return_index=True, return_inverse=True)
+        cumulative = np.zeros((len(unique_frame_ids), 3), dtype=np.int64)
+        np.add.at(cumulative, inverse, np.stack([cpu_mem_inc, gpu_mem_inc, cpu_gpu_mem_inc], axis=1))
+        if sampling_rate < 1:
+            # estimate the memory increase over all the events from the sampled ones
+            cumulative[:, :2] = np.rint(cumulative[:, :2] / sampling_rate)
+            cumulative[:, 2] = cumulative[:, 0] + cumulative[:, 1]
+        appearance_order = np.argsort(first_index, kind="stable")
+        unique_frame_ids = unique_frame_ids[appearance_order]
+        cumulative = cumulative[appearance_order]
+
+        # order by the total CPU + GPU memory increase
+        cumulative_order = np.argsort(-cumulative[:, 2], kind="stable")
+        cumulative_memory = [
+            MemoryState(
+                frame=frames[frame_id],
+                cpu=Memory(cpu_inc),
+                gpu=Memory(gpu_inc),
+                cpu_gpu=Memory(cpu_gpu_inc),
+            )
+            for frame_id, (cpu_inc, gpu_inc, cpu_gpu_inc) in zip(
+                unique_frame_ids[cumulative_order].tolist(), cumulative[cumulative_order].tolist()
+            )
+        ]
 
         if ignore_released_memory:
-            total_memory = sum(max(0, step_trace.cpu_gpu.bytes) for step_trace in memory_diff_trace)
+            total_memory = int(np.maximum(cpu_gpu_mem_inc, 0).sum())
         else:
-            total_memory = sum(step_trace.cpu_gpu.bytes for step_trace in memory_diff_trace)
+            total_memory = int(cpu_gpu_mem_inc.sum())
+        if sampling_rate < 1:
+            total_memory = int(round(total_memory / sampling_rate))
 
         total_memory = Memory(total_memory)
 
@@ -593,11 +1104,74 @@ def stop_memory_tracing(
     return None
 
 
+class MemoryTracingContext:
+    """
+    Context manager tracing the memory consumption of the code executed in its body. Tracing is started with
+    `start_memory_tracing` (or `start_memory_tracing_sampling` if `sampling` is `True`) when entering the context and
+    stopped when exiting it, even if an exception is raised. The summary returned by `stop_memory_tracing` is then
+    available as the `summary` attribute.
+
+    Example::
+
+        with MemoryTracingContext("transformers") as tracing:
+            model(input_ids)
+        print(tracing.summary.total)
+
+    Args:
+
+        - `enabled`: (bool, default True) if `False`, the context manager does nothing and `summary` is `None`
+        - `sampling`: (bool, default False) whether to use `start_memory_tracing_sampling` instead of
+          `start_memory_tracing`
+        - `ignore_released_memory`: (bool, default True) forwarded to `stop_memory_tracing`
+
+        All other arguments are forwarded to `start_memory_tracing` / `start_memory_tracing_sampling`.
+    """
+
+    def __init__(
+        self, *args, enabled: bool = True, sampling: bool = False, ignore_released_memory: bool = True, **kwargs
+    ):
+        self.enabled = enabled
+        self.sampling = sampling
+        self.ignore_released_memory = ignore_released_memory
+        self.tracing_args = args
+        self.tracing_kwargs = kwargs
+        self.summary = None
+        self._memory_trace = None
+
+    def __enter__(self):
+        if self.enabled:
+            start_fn = start_memory_tracing_sampling if self.sampling else start_memory_tracing
+            self._memory_trace = start_fn(*self.tracing_args, **self.tracing_kwargs)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            self.summary = stop_memory_tracing(self._memory_trace, ignore_released_memory=self.ignore_released_memory)
+            self._memory_trace = None
+        return False
+
+
 def bytes_to_mega_bytes(memory_amount: int) -> int:
     """Utility to convert a number of bytes (int) into a number of mega bytes (int)"""
     return memory_amount >> 20
 
 
+def _result_to_array_value(result) -> float:
+    """Converts a speed (float) or memory (`Memory`) benchmark result to a float, "N/A" results are converted to NaN"""
+    if isinstance(result, Memory):
+        return float(result.bytes)
+    if isinstance(result, (int, float)):
+        return float(result)
+    return np.nan
+
+
+def _array_value_to_result(value: float, is_memory: bool):
+    """Inverse of `_result_to_array_value`"""
+    if np.isnan(value):
+        return "N/A"
+    return Memory(int(value)) if is_memory else float(value)
+
+
 class Benchmark(ABC):
     """
     Benchmarks is a simple but feature-complete benchmarking script to compare memory and time performance of models in
@@ -611,9 +1185,10 @@ class Benchmark(ABC):
     def __init__(self, args: BenchmarkArguments = None, configs: PretrainedConfig = None):
         self.args = args
         if configs is None:
-            self.config_dict = {
-                model_name: AutoConfig.from_pretrained(model_name) for model_name in self.args.model_names
-            }
+            # loading a config is I/O bound (hub or disk), so the configs are loaded concurrently
+            model_names = self.args.model_names
+            with ThreadPoolExecutor(max_workers=max(1, min(8, len(model_names)))) as executor:
+                self.config_dict = dict(zip(model_names, executor.map(AutoConfig.from_pretrained, model_names)))
         else:
             self.config_dict = {model_name: config for model_name, config in zip(self.args.model_names, configs)}
 
@@ -647,25 +1222,80 @@ class Benchmark(ABC):
         pass
 
     @abstractmethod
-    def _inference_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
+    def _prepare_inference_func(self, model_name: str, batch_size: int, sequence_length: int) -> Callable[[], None]:
         pass
 
     @abstractmethod
-    def _train_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
+    def _prepare_train_func(self, model_name: str, batch_size: int, sequence_length: int) -> Callable[[], None]:
         pass
 
-    @abstractmethod
+    def _inference_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
+        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
+        return self._measure_speed(_inference)
+
+    def _train_speed(self, model_name: str, batch_size: int, sequence_length: int) -> float:
+        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
+        return self._measure_speed(_train)
+
     def _inference_memory(
         self, model_name: str, batch_size: int, sequence_length: int
     ) -> [Memory, Optional[MemorySummary]]:
-        pass
+        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
+        return self._measure_memory(_inference)
 
-    @abstractmethod
     def _train_memory(
         self, model_name: str, batch_size: int, sequence_length: int
     ) -> [Memory, Optional[MemorySummary]]:
+        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
+        return self._measure_memory(_train)
+
+    def _inference(
+        self, model_name: str, batch_size: int, sequence_length: int
+    ) -> [float, Memory, Optional[MemorySummary]]:
+        _inference = self._prepare_inference_func(model_name, batch_size, sequence_length)
+        return self._measure_speed_and_memory(_inference)
+
+    def _train(
+        self, model_name: str, batch_size: int, sequence_length: int
+    ) -> [float, Memory, Optional[MemorySummary]]:
+        _train = self._prepare_train_func(model_name, batch_size, sequence_length)
+        return self._measure_speed_and_memory(_train)
+
+    @abstractmethod
+    def _measure_speed(self, func: Callable[[], None]) -> float:
+        pass
+
+    @abstractmethod
+    def _measure_memory(self, func: Callable[[], None]) -> [Memory, Optional[MemorySummary]]:
         pass
 
+    def _memory_tracing_context(self) -> MemoryTracingContext:
+        """
+        Returns the context manager tracing the memory of the benchmarked function if `args.trace_memory_line_by_line`
+        is set, with the granularity and sampling rate given by `args.trace_memory_granularity` and
+        `args.trace_memory_sample_rate`. The "sample" granularity uses `start_memory_tracing_sampling` instead of
+        `start_memory_tracing`.
+        """
+        enabled = self.args.trace_memory_line_by_line
+        granularity = self.args.trace_memory_granularity
+        if granularity == "sample":
+            return MemoryTracingContext("transformers", enabled=enabled, sampling=True)
+        return MemoryTracingContext(
+            "transformers",
+            enabled=enabled,
+            granularity=granularity,
+            sampling_rate=self.args.trace_memory_sample_rate,
+        )
+
+    def _measure_speed_and_memory(self, func: Callable[[], None]) -> [float, Memory, Optional[MemorySummary]]:
+        """
+        Measures the memory and then the speed of `func` in a single pass, so that the model only has to be created
+        once. Measurements disabled in `self.args` are returned as `None`.
+        """
+        memory, summary = self._measure_memory(func) if self.args.memory else (None, None)
+        speed = self._measure_speed(func) if self.args.speed else None
+        return speed, memory, summary
+
     def inference_speed(self, *args, **kwargs) -> float:
         return separate_process_wrapper_fn(self._inference_speed, self.args.do_multi_processing)(*args, **kwargs)
 
@@ -678,51 +1308,70 @@ class Benchmark(ABC):
     def train_memory(self, *args, **kwargs) -> [Memory, Optional[MemorySummary]]:
         return separate_process_wrapper_fn(self._train_memory, self.args.do_multi_processing)(*args, **kwargs)
 
-    def run(self):
-        result_dict = {model_name: {} for model_name in self.args.model_names}
-        inference_result_time = copy.deepcopy(result_dict)
-        inference_result_memory = copy.deepcopy(result_dict)
-        train_result_time = copy.deepcopy(result_dict)
-        train_result_memory = copy.deepcopy(result_dict)
+    def inference(self, *args, **kwargs) -> [float, Memory, Optional[MemorySummary]]:
+        result = separate_process_wrapper_fn(self._inference, self.args.do_multi_processing)(*args, **kwargs)
+        # the separate process returns "N/A" if the benchmark failed
+        return result if isinstance(result, tuple) else (result, result, None)
 
-        for c, model_name in enumerate(self.args.model_names):
-            self.print_fn(f"{c + 1} / {len(self.args.model_names)}")
+    def train(self, *args, **kwargs) -> [float, Memory, Optional[MemorySummary]]:
+        result = separate_process_wrapper_fn(self._train, self.args.do_multi_processing)(*args, **kwargs)
+        # the separate process returns "N/A" if the benchmark failed
+        return result if isinstance(result, tuple) else (result, result, None)
 
-            model_dict = {
-                "bs": self.args.batch_sizes,
-                "ss": self.args.sequence_lengths,
-                "result": {i: {} for i in self.args.batch_sizes},
+    def _results_to_dict(self, results: np.ndarray, is_memory: bool, measured: bool) -> dict:
+        """
+        Converts a results array indexed by (model, batch size, sequence length) to the nested dict returned in
+        `BenchmarkOutput`, mapping each model name to `{"bs": ..., "ss": ..., "result": {batch_size: {sequence_length:
+        result}}}`. If the results were not `measured`, the result dicts are left empty.
+        """
+        return {
+            model_name: {
+                "bs": list(self.args.batch_sizes),
+                "ss": list(self.args.sequence_lengths),
+                "result": {
+                    batch_size: {
+                        sequence_length: _array_value_to_result(results[m, b, s], is_memory)
+                        for s, sequence_length in enumerate(self.args.sequence_lengths)
+                    }
+                    if measured
+                    else {}
+                    for b, batch_size in enumerate(self.args.batch_sizes)
+                },
             }
-            inference_result_time[model_name] = copy.deepcopy(model_dict)
-            inference_result_memory[model_name] = copy.deepcopy(model_dict)
-            train_result_time[model_name] = copy.deepcopy(model_dict)
-            train_result_memory[model_name] = copy.deepcopy(model_dict)
+            for m, model_name in enumerate(self.args.model_names)
+        }
+
+    def run(self):
+        # results are stored in arrays indexed by (model, batch size, sequence length), NaN meaning "N/A"
+        num_models = len(self.args.model_names)
+        shape = (num_models, len(self.args.batch_sizes), len(self.args.sequence_lengths))
+        inference_result_time = np.full(shape, np.nan)
+        inference_result_memory = np.full(shape, np.nan)
+        train_result_time = np.full(shape, np.nan)
+        train_result_memory = np.full(shape, np.nan)
+
+        for c, model_name in enumerate(self.args.model_names):
+            self.print_fn(f"{c + 1} / {num_models}")
 
             inference_summary = train_summary = None
 
-            for batch_size in self.args.batch_sizes:
-                for sequence_length in self.args.sequence_lengths:
-                    if self.args.inference:
-                        if self.args.memory:
-                            memory, inference_summary = self.inference_memory(model_name, batch_size, sequence_length)
-                            inference_result_memory[model_name]["result"][batch_size][sequence_length] = memory
-                        if self.args.speed:
-                            time = self.inference_speed(model_name, batch_size, sequence_length)
-                            inference_result_time[model_name]["result"][batch_size][sequence_length] = time
-
-                    if self.args.training:
-                        if self.args.memory:
-                            memory, train_summary = self.train_memory(model_name, batch_size, sequence_length)
-                            train_result_memory[model_name]["result"][batch_size][sequence_length] = memory
-                        if self.args.speed:
-                            time = self.train_speed(model_name, batch_size, sequence_length)
-                            train_result_time[model_name]["result"][batch_size][sequence_length] = time
+            for b, batch_size in enumerate(self.args.batch_sizes):
+                for s, sequence_length in enumerate(self.args.sequence_lengths):
+                    if self.args.inference and (self.args.memory or self.args.speed):
+                        time, memory, inference_summary = self.inference(model_name, batch_size, sequence_length)
+                        inference_result_memory[c, b, s] = _result_to_array_value(memory)
+                        inference_result_time[c, b, s] = _result_to_array_value(time)
+
+                    if self.args.training and (self.args.memory or self.args.speed):
+                        time, memory, train_summary = self.train(model_name, batch_size, sequence_length)
+                        train_result_memory[c, b, s] = _result_to_array_value(memory)
+                        train_result_time[c, b, s] = _result_to_array_value(time)
 
         if self.args.inference:
             if self.args.speed:
                 self.print_fn("\n" + 20 * "=" + ("INFERENCE - SPEED - RESULT").center(40) + 20 * "=")
-                self.print_results(inference_result_time, type_label="Time in s")
-                self.save_to_csv(inference_result_time, self.args.inference_time_csv_file)
+                self.print_results(inference_result_time, type_label="Time in s", is_memory=False)
+                self.save_to_csv(inference_result_time, self.args.inference_time_csv_file, is_memory=False)
                 if self.args.is_tpu:
                     self.print_fn(
                         "TPU was used for inference. Note that the time after compilation stabilized (after ~10 inferences model.forward(..) calls) was measured."
@@ -730,18 +1379,21 @@ class Benchmark(ABC):
 
             if self.args.memory:
                 self.print_fn("\n" + 20 * "=" + ("INFERENCE - MEMORY - RESULT").center(40) + 20 * "=")
-                self.print_results(inference_result_memory, type_label="Memory in MB")
-                self.save_to_csv(inference_result_memory, self.args.inference_memory_csv_file)
+                self.print_results(inference_result_memory, type_label="Memory in MB", is_memory=True)
+                self.save_to_csv(inference_result_memory, self.args.inference_memory_csv_file, is_memory=True)
 
             if self.args.trace_memory_line_by_line:
                 self.print_fn("\n" + 20 * "=" + ("INFERENCE - MEMOMRY - LINE BY LINE - SUMMARY").center(40) + 20 * "=")
-                self.print_memory_trace_statistics(inference_summary)
+                if inference_summary is not None:
+                    self.print_memory_trace_statistics(inference_summary)
+                else:
+                    self.print_fn("No memory trace was recorded.")
 
         if self.args.training:
             if self.args.speed:
                 self.print_fn("\n" + 20 * "=" + ("TRAIN - SPEED - RESULTS").center(40) + 20 * "=")
-                self.print_results(train_result_time, "Time in s")
-                self.save_to_csv(train_result_time, self.args.train_time_csv_file)
+                self.print_results(train_result_time, type_label="Time in s", is_memory=False)
+                self.save_to_csv(train_result_time, self.args.train_time_csv_file, is_memory=False)
                 if self.args.is_tpu:
                     self.print_fn(
                         "TPU was used for training. Note that the time after compilation stabilized (after ~10 train loss=model.forward(...) + loss.backward() calls) was measured."
@@ -749,12 +1401,15 @@ class Benchmark(ABC):
 
             if self.args.memory:
                 self.print_fn("\n" + 20 * "=" + ("TRAIN - MEMORY - RESULTS").center(40) + 20 * "=")
-                self.print_results(train_result_memory, type_label="Memory in MB")
-                self.save_to_csv(train_result_memory, self.args.train_memory_csv_file)
+                self.print_results(train_result_memory, type_label="Memory in MB", is_memory=True)
+                self.save_to_csv(train_result_memory, self.args.train_memory_csv_file, is_memory=True)
 
             if self.args.trace_memory_line_by_line:
                 self.print_fn("\n" + 20 * "=" + ("TRAIN - MEMOMRY - LINE BY LINE - SUMMARY").center(40) + 20 * "=")
-                self.print_memory_trace_statistics(train_summary)
+                if train_summary is not None:
+                    self.print_memory_trace_statistics(train_summary)
+                else:
+                    self.print_fn("No memory trace was recorded.")
 
         if self.args.env_print:
             self.print_fn("\n" + 20 * "=" + ("ENVIRONMENT INFORMATION").center(40) + 20 * "=")
@@ -767,10 +1422,10 @@ class Benchmark(ABC):
                     writer.writerow([key, value])
 
         return BenchmarkOutput(
-            inference_result_time,
-            inference_result_memory,
-            train_result_time,
-            train_result_memory,
+            self._results_to_dict(inference_result_time, False, self.args.inference and self.args.speed),
+            self._results_to_dict(inference_result_memory, True, self.args.inference and self.args.memory),
+            self._results_to_dict(train_result_time, False, self.args.training and self.args.speed),
+            self._results_to_dict(train_result_memory, True, self.args.training and self.args.memory),
             inference_summary,
             train_summary,
         )
@@ -834,26 +1489,24 @@ class Benchmark(ABC):
             self._environment_info = info
         return self._environment_info
 
-    def print_results(self, result_dict, type_label):
+    def print_results(self, results: np.ndarray, type_label: str, is_memory: bool):
         self.print_fn(80 * "-")
         self.print_fn(
             "Model Name".center(30) + "Batch Size".center(15) + "Seq Length".center(15) + type_label.center(15)
         )
         self.print_fn(80 * "-")
-        for model_name in self.args.model_names:
-            for batch_size in result_dict[model_name]["bs"]:
-                for sequence_length in result_dict[model_name]["ss"]:
-                    result = result_dict[model_name]["result"][batch_size][sequence_length]
-                    if isinstance(result, float):
-                        result = round(1000 * result) / 1000
-                        result = "< 0.001" if result == 0.0 else str(result)
-                    else:
-                        result = str(result)
-                    self.print_fn(
-                        model_name[:30].center(30) + str(batch_size).center(15),
-                        str(sequence_length).center(15),
-                        result.center(15),
-                    )
+        for (m, b, s), value in np.ndenumerate(results):
+            result = _array_value_to_result(value, is_memory)
+            if isinstance(result, float):
+                result = round(1000 * result) / 1000
+                result = "< 0.001" if result == 0.0 else str(result)
+            else:
+                result = str(result)
+            self.print_fn(
+                self.args.model_names[m][:30].center(30) + str(self.args.batch_sizes[b]).center(15),
+                str(self.args.sequence_lengths[s]).center(15),
+                result.center(15),
+            )
         self.print_fn(80 * "-")
 
     def print_memory_trace_statistics(self, summary: MemorySummary):
@@ -880,30 +1533,25 @@ class Benchmark(ABC):
         )
         self.print_fn(f"\nTotal memory increase: {summary.total}")
 
-    def save_to_csv(self, result_dict, filename):
+    def save_to_csv(self, results: np.ndarray, filename: str, is_memory: bool):
         if not self.args.save_to_csv:
             return
         self.print_fn("Saving results to csv.")
-        with open(filename, mode="w") as csv_file:
-
-            assert len(self.args.model_names) > 0, f"At least 1 model should be defined, but got {self.model_names}"
-
-            fieldnames = ["model", "batch_size", "sequence_length"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames + ["result"])
-            writer.writeheader()
-
-            for model_name in self.args.model_names:
-                result_dict_model = result_dict[model_name]["result"]
-                for bs in result_dict_model:
-                    for ss in result_dict_model[bs]:
-                        result_model = result_dict_model[bs][ss]
-                        writer.writerow(
-                            {
-                                "model": model_name,
-                                "batch_size": bs,
-                                "sequence_length": ss,
-                                "result": ("{}" if not isinstance(result_model, float) else "{:.4f}").format(
-                                    result_model
-                                ),
-                            }
-                        )
+        assert len(self.args.model_names) > 0, f"At least 1 model should be defined, but got {self.model_names}"
+
+        rows = []
+        for (m, b, s), value in np.ndenumerate(results):
+            result = _array_value_to_result(value, is_memory)
+            rows.append(
+                (
+                    self.args.model_names[m],
+                    self.args.batch_sizes[b],
+                    self.args.sequence_lengths[s],
+                    "{:.4f}".format(result) if isinstance(result, float) else str(result),
+                )
+            )
+
+        with open(filename, mode="w", newline="", buffering=1 << 16) as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["model", "batch_size", "sequence_length", "result"])
+            writer.writerows(rows)
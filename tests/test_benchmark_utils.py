@@ -0,0 +1,381 @@
+# Copyright 2020 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import threading
+import types
+import unittest
+from unittest.mock import patch
+
+from transformers.benchmark import benchmark_utils
+from transformers.benchmark.benchmark_utils import (
+    Benchmark,
+    MemoryTracingContext,
+    _module_filter,
+    _modules_to_path_prefixes,
+    _trace_sampling_random,
+    _TraceBuffer,
+    is_memory_tracing_enabled,
+    start_memory_tracing,
+    start_memory_tracing_sampling,
+    stop_memory_tracing,
+)
+from transformers.file_utils import is_psutil_available
+
+
+def allocate(n=100):
+    blocks = []
+    for _ in range(n):
+        blocks.append(bytearray(1000))
+    return blocks
+
+
+def allocate_on_one_line(n=100):
+    # only the `keep.append` line allocates memory
+    keep = []
+    for _ in range(n):
+        a = 1
+        keep.append(b"x" * 200000)
+        b = 2
+        c = 3
+        d = 4
+        e = 5
+    del a, b, c, d, e
+    return keep
+
+
+class FakeProcess:
+    def __init__(self):
+        self.rss = 0
+
+    def memory_info(self):
+        return types.SimpleNamespace(rss=self.rss)
+
+
+def allocate_on_one_line_of_fake_memory(process, n=100):
+    # same as `allocate_on_one_line` with a fake rss memory
+    for _ in range(n):
+        a = 1
+        process.rss += 200000
+        b = 2
+        c = 3
+        d = 4
+        e = 5
+    del a, b, c, d, e
+
+
+def cumulative_cpu_memory_per_line(summary):
+    memory_per_line = {}
+    for state in summary.cumulative:
+        line = state.frame.line_text.strip()
+        memory_per_line[line] = memory_per_line.get(line, 0) + state.cpu.bytes
+    return memory_per_line
+
+
+class TraceBufferTest(unittest.TestCase):
+    def record(self, memory_trace, num_events):
+        file_id = memory_trace.intern_filename(__file__, __name__)
+        event_id = memory_trace.intern_event("line")
+        for i in range(num_events):
+            memory_trace.append(file_id, i + 1, event_id, i, 2 * i)
+
+    def test_iteration_order(self):
+        memory_trace = _TraceBuffer(capacity=16, initial_size=2)
+        self.record(memory_trace, 10)
+
+        self.assertEqual(len(memory_trace), 10)
+        self.assertEqual([state.cpu_memory for state in memory_trace], list(range(10)))
+        self.assertEqual([state.gpu_memory for state in memory_trace], [2 * i for i in range(10)])
+        self.assertEqual([state.frame.line_number for state in memory_trace], list(range(1, 11)))
+        self.assertTrue(all(state.frame.event == "line" for state in memory_trace))
+
+    def test_grows_lazily(self):
+        memory_trace = _TraceBuffer(capacity=16, initial_size=2)
+        self.assertEqual(len(memory_trace.cpu), 2)
+        self.record(memory_trace, 5)
+        self.assertEqual(len(memory_trace.cpu), 8)
+        self.record(memory_trace, 20)
+        self.assertEqual(len(memory_trace.cpu), 16)
+
+    def test_wraparound_keeps_most_recent_events(self):
+        memory_trace = _TraceBuffer(capacity=4, initial_size=4)
+        self.record(memory_trace, 10)
+
+        self.assertEqual(len(memory_trace), 4)
+        self.assertEqual([state.cpu_memory for state in memory_trace], [6, 7, 8, 9])
+        self.assertEqual([state.frame.line_number for state in memory_trace], [7, 8, 9, 10])
+
+        cpu_mem, gpu_mem, frame_ids, frames = memory_trace.to_arrays()
+        self.assertEqual(cpu_mem.tolist(), [6, 7, 8, 9])
+        self.assertEqual(gpu_mem.tolist(), [12, 14, 16, 18])
+        self.assertEqual([frames[i].line_number for i in frame_ids], [7, 8, 9, 10])
+
+    def test_indexing(self):
+        memory_trace = _TraceBuffer(capacity=4, initial_size=4)
+        self.record(memory_trace, 6)
+
+        self.assertEqual(memory_trace[0].cpu_memory, 2)
+        self.assertEqual(memory_trace[-1].cpu_memory, 5)
+        self.assertEqual([state.cpu_memory for state in memory_trace[1:3]], [3, 4])
+        self.assertEqual(memory_trace[:], list(memory_trace))
+        with self.assertRaises(IndexError):
+            memory_trace[4]
+
+
+class MemoryTracingTest(unittest.TestCase):
+    def test_line_granularity(self):
+        memory_trace = start_memory_tracing(__name__)
+        allocate()
+        summary = stop_memory_tracing(memory_trace)
+
+        self.assertIsNotNone(summary)
+        self.assertEqual({state.frame.event for state in memory_trace}, {"line"})
+        self.assertIn("blocks.append(bytearray(1000))", {state.frame.line_text.strip() for state in memory_trace})
+
+    def test_call_granularity(self):
+        profile_function = sys.getprofile()
+        memory_trace = start_memory_tracing(__name__, granularity="call")
+        self.assertIsNotNone(sys.getprofile())
+        for _ in range(3):
+            allocate(1)
+        stop_memory_tracing(memory_trace)
+
+        self.assertIs(sys.getprofile(), profile_function)
+        # calls are recorded on the `def` line of the function and returns on the `return` line
+        allocate_states = [
+            (state.frame.event, state.frame.line_text.strip())
+            for state in memory_trace
+            if state.frame.line_text.strip() in ("def allocate(n=100):", "return blocks")
+        ]
+        self.assertEqual(allocate_states, [("call", "def allocate(n=100):"), ("return", "return blocks")] * 3)
+        self.assertTrue(all(state.frame.event in ("call", "return") for state in memory_trace))
+
+    def test_sampling_rate(self):
+        memory_trace = start_memory_tracing(__name__)
+        allocate(2000)
+        stop_memory_tracing(memory_trace)
+        num_events = len(memory_trace)
+
+        _trace_sampling_random.seed(0)
+        sampled_memory_trace = start_memory_tracing(__name__, sampling_rate=0.1)
+        allocate(2000)
+        stop_memory_tracing(sampled_memory_trace)
+
+        sampled_events = [state for state in sampled_memory_trace if state.frame.event != "sample_end"]
+        self.assertGreater(len(sampled_events), 0.08 * num_events)
+        self.assertLess(len(sampled_events), 0.12 * num_events)
+        # the first event is always recorded
+        self.assertEqual(sampled_memory_trace[0].frame, memory_trace[0].frame)
+        # each sampled event is followed by the event ending its measure
+        self.assertLess(len(sampled_memory_trace), 2 * len(sampled_events) + 1)
+
+    def test_sampled_memory_is_attributed_to_the_allocating_line(self):
+        # the rss memory only grows on the allocating line, independently of the allocator reusing freed memory
+        process = FakeProcess()
+        _trace_sampling_random.seed(0)
+        with patch.object(benchmark_utils, "_setup_memory_tracing", return_value=(process, None)):
+            memory_trace = start_memory_tracing(__name__, sampling_rate=0.2, cpu_poll_interval_us=0)
+        allocate_on_one_line_of_fake_memory(process, 2000)
+        summary = stop_memory_tracing(memory_trace, ignore_released_memory=False)
+
+        memory_per_line = cumulative_cpu_memory_per_line(summary)
+        allocated = memory_per_line.pop("process.rss += 200000")
+        # the memory of the sampled lines is scaled by 1 / sampling_rate
+        self.assertGreater(allocated, 0.8 * 2000 * 200000)
+        self.assertLess(allocated, 1.2 * 2000 * 200000)
+        self.assertEqual(set(memory_per_line.values()), {0})
+        self.assertAlmostEqual(summary.total.bytes, allocated, delta=1)
+
+    @unittest.skipUnless(is_psutil_available(), "test requires psutil")
+    def test_memory_is_attributed_to_the_allocating_line(self):
+        memory_trace = start_memory_tracing(__name__)
+        keep = allocate_on_one_line()
+        summary = stop_memory_tracing(memory_trace, ignore_released_memory=False)
+        del keep
+
+        memory_per_line = cumulative_cpu_memory_per_line(summary)
+        allocated = memory_per_line.pop('keep.append(b"x" * 200000)')
+        self.assertGreater(allocated, 0.9 * 100 * 200000)
+        for line in ("a = 1", "b = 2", "c = 3", "d = 4", "e = 5"):
+            self.assertLess(memory_per_line[line], 0.05 * allocated)
+
+    def test_warns_about_dropped_events(self):
+        memory_trace = start_memory_tracing(__name__, max_trace_length=50)
+        allocate()
+        with self.assertLogs("transformers.benchmark.benchmark_utils", level="WARNING") as logs:
+            stop_memory_tracing(memory_trace)
+        self.assertIn(f"the oldest {memory_trace.head - 50} events were dropped", "\n".join(logs.output))
+
+    def test_invalid_sampling_rate(self):
+        for sampling_rate in (0, -0.5, 1.5):
+            with self.assertRaises(ValueError):
+                start_memory_tracing(sampling_rate=sampling_rate)
+
+    def test_invalid_granularity(self):
+        with self.assertRaises(ValueError):
+            start_memory_tracing(granularity="instruction")
+
+
+class ModuleFilterTest(unittest.TestCase):
+    def traced_modules(self, modules_to_trace=None, modules_not_to_trace=None):
+        memory_trace = start_memory_tracing(modules_to_trace, modules_not_to_trace)
+        json.dumps(json.loads('{"a": [1, 2, {"b": null}]}'))
+        stop_memory_tracing(memory_trace)
+        return {state.frame.module for state in memory_trace}
+
+    def test_path_prefixes(self):
+        json_dir = os.path.dirname(json.__file__)
+        self.assertEqual(_modules_to_path_prefixes(("json",)), (os.path.join(json_dir, ""),))
+        self.assertEqual(_modules_to_path_prefixes(("json.decoder",)), (json.decoder.__file__,))
+        self.assertIsNone(_modules_to_path_prefixes(("json", "not_a_module")))
+
+        # e.g. `__main__` when running a script
+        module_without_spec = types.ModuleType("module_without_spec")
+        module_without_spec.__spec__ = None
+        with patch.dict(sys.modules, {"module_without_spec": module_without_spec}):
+            self.assertIsNone(_modules_to_path_prefixes(("module_without_spec",)))
+
+    def test_unresolvable_modules_are_matched_by_name(self):
+        allowed_prefixes, is_traced_module = _module_filter("not_a_module", "not_a_module.skipped")
+        self.assertEqual(allowed_prefixes, ())
+        self.assertTrue(is_traced_module("not_a_module"))
+        self.assertTrue(is_traced_module("not_a_module.sub"))
+        self.assertFalse(is_traced_module("not_a_module.skipped.sub"))
+        self.assertFalse(is_traced_module("json"))
+        self.assertFalse(is_traced_module(None))
+
+    def test_package(self):
+        self.assertEqual(self.traced_modules("json"), {"json", "json.decoder", "json.encoder"})
+
+    def test_submodule(self):
+        self.assertEqual(self.traced_modules("json.decoder"), {"json.decoder"})
+
+    def test_unresolvable_module(self):
+        self.assertEqual(self.traced_modules("not_a_module"), set())
+        self.assertEqual(self.traced_modules(["json.decoder", "not_a_module"]), {"json.decoder"})
+
+    def test_blacklist(self):
+        self.assertEqual(self.traced_modules("json", "encoder"), {"json", "json.decoder"})
+        self.assertNotIn("json.decoder", self.traced_modules(modules_not_to_trace="json.decoder"))
+
+
+class MemoryTracingSamplingTest(unittest.TestCase):
+    def test_short_trace_has_summary(self):
+        # the traced code runs for much less than the interpreter switch interval
+        memory_trace = start_memory_tracing_sampling()
+        allocate(1)
+        summary = stop_memory_tracing(memory_trace)
+
+        self.assertGreaterEqual(len(memory_trace), 2)
+        self.assertIsNotNone(summary)
+        self.assertTrue(all(state.frame.event == "sample" for state in memory_trace))
+
+    def test_samples_are_attributed_to_traced_modules(self):
+        memory_trace = start_memory_tracing_sampling(modules_to_trace=__name__)
+        for _ in range(100):
+            allocate()
+        stop_memory_tracing(memory_trace)
+
+        self.assertGreaterEqual(len(memory_trace), 2)
+        self.assertTrue(all(state.frame.module == __name__ for state in memory_trace))
+
+    def test_stop_joins_sampling_thread(self):
+        num_threads = threading.active_count()
+        memory_trace = start_memory_tracing_sampling()
+        self.assertEqual(threading.active_count(), num_threads + 1)
+        stop_memory_tracing(memory_trace)
+        self.assertEqual(threading.active_count(), num_threads)
+
+
+class MemoryTracingContextTest(unittest.TestCase):
+    def test_summary(self):
+        with MemoryTracingContext(__name__) as tracing:
+            allocate()
+        self.assertIsNotNone(tracing.summary)
+        self.assertFalse(is_memory_tracing_enabled())
+
+    def test_disabled(self):
+        trace_function = sys.gettrace()
+        with MemoryTracingContext(__name__, enabled=False) as tracing:
+            self.assertFalse(is_memory_tracing_enabled())
+            self.assertIs(sys.gettrace(), trace_function)
+            allocate()
+        self.assertIsNone(tracing.summary)
+
+    def test_tracing_code_is_not_traced(self):
+        for modules_to_trace in (None, "transformers"):
+            memory_trace = start_memory_tracing(modules_to_trace)
+            allocate()
+            stop_memory_tracing(memory_trace)
+            self.assertNotIn(benchmark_utils.__file__, {state.frame.filename for state in memory_trace})
+
+            with MemoryTracingContext(modules_to_trace) as tracing:
+                allocate()
+            if tracing.summary is not None:
+                traced_files = {state.frame.filename for state in tracing.summary.sequential}
+                self.assertNotIn(benchmark_utils.__file__, traced_files)
+
+    def test_tracing_is_stopped_on_exception(self):
+        trace_function = sys.gettrace()
+        with self.assertRaises(ValueError):
+            with MemoryTracingContext(__name__):
+                allocate()
+                raise ValueError()
+        self.assertFalse(is_memory_tracing_enabled())
+        self.assertIs(sys.gettrace(), trace_function)
+
+    def test_previous_hooks_are_restored(self):
+        def trace_function(frame, event, arg):
+            return None
+
+        def profile_function(frame, event, arg):
+            return None
+
+        previous_trace_function, previous_profile_function = sys.gettrace(), sys.getprofile()
+        sys.settrace(trace_function)
+        sys.setprofile(profile_function)
+        try:
+            for start_fn in (start_memory_tracing, start_memory_tracing_sampling):
+                memory_trace = start_fn(__name__)
+                allocate()
+                stop_memory_tracing(memory_trace)
+                self.assertIs(sys.gettrace(), trace_function)
+                self.assertIs(sys.getprofile(), profile_function)
+        finally:
+            sys.settrace(previous_trace_function)
+            sys.setprofile(previous_profile_function)
+
+
+class BenchmarkMemoryTracingContextTest(unittest.TestCase):
+    def memory_tracing_context(self, **kwargs):
+        args = dict(
+            trace_memory_line_by_line=True, trace_memory_granularity="line", trace_memory_sample_rate=1.0, speed=True
+        )
+        args.update(kwargs)
+        return Benchmark._memory_tracing_context(types.SimpleNamespace(args=types.SimpleNamespace(**args)))
+
+    def test_line_by_line_tracing_when_measuring_speed(self):
+        tracing = self.memory_tracing_context()
+        self.assertTrue(tracing.enabled)
+        self.assertFalse(tracing.sampling)
+        self.assertEqual(tracing.tracing_kwargs["granularity"], "line")
+
+    def test_sample_granularity(self):
+        tracing = self.memory_tracing_context(trace_memory_granularity="sample", speed=False)
+        self.assertTrue(tracing.sampling)
+
+    def test_disabled(self):
+        self.assertFalse(self.memory_tracing_context(trace_memory_line_by_line=False).enabled)